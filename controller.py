@@ -1,19 +1,76 @@
 """
 Controller for the OpenWeatherMap MCP server.
 """
-from typing import Dict, Any, Optional
+import asyncio
+from typing import Awaitable, Callable, Dict, Any, List, Optional, Tuple, Union
 from fastmcp import Context
 
-from provider import OpenWeatherMapProvider
-from models import FormattedWeatherResponse, CurrentWeatherResponse
+from provider import EMPTY_STATS, OpenWeatherMapProvider
+from models import WeatherError
+
+# Output template and unit symbols for _format_weather_response, built once at import
+_TEMPLATE = (
+    "Weather for {location}{stale}:\n"
+    "Temperature: {temp} (Feels like: {feels})\n"
+    "Conditions: {cond}\n"
+    "Humidity: {hum}\n"
+    "Wind: {wind}\n"
+    "Pressure: {p}\n"
+    "Visibility: {vis}"
+)
+_UNIT_TABLE = {
+    "metric": ("°C", "m/s"),
+    "imperial": ("°F", "mph"),
+    "standard": ("K", "m/s"),
+}
+
+# Shown in place of values missing from the API response
+_MISSING = "N/A"
+
+
+def _measure(value: Any, unit: str, as_float: bool = False) -> str:
+    """Render a value with its unit, or N/A if the API response omitted it."""
+    if value is None:
+        return _MISSING
+    return f"{float(value) if as_float else value}{unit}"
 
 
 class WeatherController:
     """Controller for handling weather data requests."""
     
     def __init__(self):
-        """Initialize the controller with the OpenWeatherMap provider."""
-        self.provider = OpenWeatherMapProvider()
+        """Initialize the controller; the provider is created on first use."""
+        self._provider: Optional[OpenWeatherMapProvider] = None
+    
+    @property
+    def provider(self) -> OpenWeatherMapProvider:
+        """The OpenWeatherMap provider, constructed on first access."""
+        if self._provider is None:
+            self._provider = OpenWeatherMapProvider()
+        return self._provider
+    
+    async def aclose(self) -> None:
+        """
+        Release resources held by the provider, if it was created.
+        
+        The provider is dropped so the next access builds a fresh one; the
+        server lifespan may close and reopen the shared controller.
+        """
+        if self._provider is not None:
+            provider, self._provider = self._provider, None
+            await provider.aclose()
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Get cache and upstream request statistics from the provider.
+        
+        Returns:
+            Statistics as reported by OpenWeatherMapProvider.get_stats; empty
+            statistics if the provider hasn't been created yet
+        """
+        if self._provider is None:
+            return dict(EMPTY_STATS)
+        return self._provider.get_stats()
     
     async def get_weather_by_city(
         self, 
@@ -39,21 +96,86 @@ class WeatherController:
         if ctx:
             await ctx.info(f"Fetching weather for city: {city}")
             
-        response, success = await self.provider.get_current_weather_by_city(
-            city=city,
-            country_code=country_code,
-            units=units,
-            lang=lang
+        result, success = await self._get_formatted(
+            {"city": city, "country_code": country_code, "units": units, "lang": lang},
+            lambda: self.provider.get_current_weather_by_city(
+                city=city,
+                country_code=country_code,
+                units=units,
+                lang=lang
+            ),
+            units
         )
         
         if success:
-            return self._format_weather_response(response, units)
+            return result
         else:
-            error_message = f"Error fetching weather data: {response.message}"
+            error_message = f"Error fetching weather data: {result.message}"
             if ctx:
                 await ctx.error(error_message)
             return error_message
     
+    async def get_weather_bulk(
+        self, 
+        cities: List[str], 
+        country_code: Optional[str] = None,
+        units: str = "metric",
+        lang: str = "en",
+        ctx: Optional[Context] = None
+    ) -> List[str]:
+        """
+        Get current weather for several cities concurrently.
+        
+        Args:
+            cities: City names
+            country_code: Country code (ISO 3166) applied to every city
+            units: Units of measurement (standard, metric, imperial)
+            lang: Language for weather descriptions
+            ctx: MCP Context for logging
+            
+        Returns:
+            Formatted weather information (or an error message) for each city, in order
+        """
+        if ctx:
+            await ctx.info(f"Fetching weather for {len(cities)} cities")
+            
+        # A failure for one city must not cancel the rest of the batch
+        results = await asyncio.gather(
+            *(
+                self._get_formatted(
+                    {"city": city, "country_code": country_code, "units": units, "lang": lang},
+                    lambda city=city: self.provider.get_current_weather_by_city(
+                        city=city,
+                        country_code=country_code,
+                        units=units,
+                        lang=lang
+                    ),
+                    units
+                )
+                for city in cities
+            ),
+            return_exceptions=True
+        )
+        
+        formatted = []
+        for city, result in zip(cities, results):
+            if isinstance(result, BaseException):
+                text, success = None, False
+                reason = str(result) or type(result).__name__
+            else:
+                text, success = result
+                reason = None if success else text.message
+            
+            if success:
+                formatted.append(text)
+            else:
+                error_message = f"Error fetching weather data for {city}: {reason}"
+                if ctx:
+                    await ctx.error(error_message)
+                formatted.append(error_message)
+        
+        return formatted
+    
     async def get_weather_by_coords(
         self, 
         lat: float, 
@@ -78,17 +200,21 @@ class WeatherController:
         if ctx:
             await ctx.info(f"Fetching weather for coordinates: {lat}, {lon}")
             
-        response, success = await self.provider.get_current_weather_by_coords(
-            lat=lat,
-            lon=lon,
-            units=units,
-            lang=lang
+        result, success = await self._get_formatted(
+            {"lat": lat, "lon": lon, "units": units, "lang": lang},
+            lambda: self.provider.get_current_weather_by_coords(
+                lat=lat,
+                lon=lon,
+                units=units,
+                lang=lang
+            ),
+            units
         )
         
         if success:
-            return self._format_weather_response(response, units)
+            return result
         else:
-            error_message = f"Error fetching weather data: {response.message}"
+            error_message = f"Error fetching weather data: {result.message}"
             if ctx:
                 await ctx.error(error_message)
             return error_message
@@ -117,65 +243,110 @@ class WeatherController:
         if ctx:
             await ctx.info(f"Fetching weather for zip code: {zip_code}, {country_code}")
             
-        response, success = await self.provider.get_current_weather_by_zip(
-            zip_code=zip_code,
-            country_code=country_code,
-            units=units,
-            lang=lang
+        result, success = await self._get_formatted(
+            {"zip": zip_code, "country_code": country_code, "units": units, "lang": lang},
+            lambda: self.provider.get_current_weather_by_zip(
+                zip_code=zip_code,
+                country_code=country_code,
+                units=units,
+                lang=lang
+            ),
+            units
         )
         
         if success:
-            return self._format_weather_response(response, units)
+            return result
         else:
-            error_message = f"Error fetching weather data: {response.message}"
+            error_message = f"Error fetching weather data: {result.message}"
             if ctx:
                 await ctx.error(error_message)
             return error_message
     
-    def _format_weather_response(self, weather: CurrentWeatherResponse, units: str) -> str:
+    async def _get_formatted(
+        self,
+        query: Dict[str, Any],
+        fetch: Callable[[], Awaitable[Tuple[Union[Dict[str, Any], WeatherError], bool, bool]]],
+        units: str
+    ) -> Tuple[Union[str, WeatherError], bool]:
+        """
+        Get formatted weather information, serving it from the text cache when possible.
+        
+        Args:
+            query: Lookup parameters identifying the formatted result
+            fetch: Callable that fetches the weather data from the provider on a cache miss
+            units: Units of measurement used
+            
+        Returns:
+            Tuple containing the formatted string (or an error) and a boolean indicating success
+        """
+        cached = await self.provider.get_cached_text("/weather", query)
+        if cached is not None:
+            return cached, True
+        
+        response, success, stale = await fetch()
+        if not success:
+            return response, False
+        
+        try:
+            formatted = self._format_weather_response(response, units, stale)
+        except Exception as e:
+            # A malformed payload (live or from the cache) is reported like any other error
+            return WeatherError(cod=500, message=f"Unexpected response format: {e!r}"), False
+        
+        # Stale fallback data isn't cached so fresh data is served once the API recovers
+        if not stale:
+            await self.provider.set_cached_text("/weather", query, formatted)
+        return formatted, True
+    
+    def _format_weather_response(self, weather: Dict[str, Any], units: str, stale: bool = False) -> str:
         """
         Format the weather response into a human-readable string.
         
         Args:
-            weather: Weather response from the provider
+            weather: Raw weather data from the provider, shaped like CurrentWeatherResponse
             units: Units of measurement used
+            stale: Whether the data was served from the fallback cache
             
         Returns:
             Formatted weather information as string
         """
-        # Get the temperature unit symbol based on the units parameter
-        temp_unit = "°C" if units == "metric" else "°F" if units == "imperial" else "K"
+        # Get the temperature and wind speed unit symbols based on the units parameter
+        temp_unit, wind_unit = _UNIT_TABLE.get(units, _UNIT_TABLE["standard"])
         
-        # Get the wind speed unit based on the units parameter
-        wind_unit = "m/s" if units == "metric" else "mph" if units == "imperial" else "m/s"
+        # Sections may be missing or null in the raw payload
+        main = weather.get("main") or {}
+        wind = weather.get("wind") or {}
+        sys_info = weather.get("sys") or {}
+        
+        # Get the location name, with the country code when it is known
+        location = weather.get("name") or _MISSING
+        if sys_info.get("country"):
+            location = f"{location}, {sys_info['country']}"
         
         # Get the main weather condition
-        condition = weather.weather[0].description.capitalize() if weather.weather else "Unknown"
-        
-        # Format the response
-        formatted = FormattedWeatherResponse(
-            location=weather.name,
-            country=weather.sys.country,
-            temperature=weather.main.temp,
-            feels_like=weather.main.feels_like,
-            conditions=condition,
-            humidity=weather.main.humidity,
-            wind_speed=weather.wind.speed,
-            wind_direction=weather.wind.deg,
-            pressure=weather.main.pressure,
-            visibility=weather.visibility / 1000,  # Convert to km
-            sunrise=weather.sys.sunrise,
-            sunset=weather.sys.sunset,
-            timezone=weather.timezone
-        )
+        conditions = weather.get("weather")
+        description = conditions[0].get("description") if conditions else None
+        condition = description.capitalize() if description else "Unknown"
+        
+        # Get the wind speed, with its direction when it is known
+        wind_text = _measure(wind.get("speed"), f" {wind_unit}", as_float=True)
+        if wind.get("speed") is not None and wind.get("deg") is not None:
+            wind_text = f"{wind_text} at {wind['deg']}°"
         
-        # Convert to a readable string
-        return f"""
-Weather for {formatted.location}, {formatted.country}:
-Temperature: {formatted.temperature}{temp_unit} (Feels like: {formatted.feels_like}{temp_unit})
-Conditions: {formatted.conditions}
-Humidity: {formatted.humidity}%
-Wind: {formatted.wind_speed} {wind_unit} at {formatted.wind_direction}°
-Pressure: {formatted.pressure} hPa
-Visibility: {formatted.visibility:.1f} km
-        """.strip()
+        visibility = weather.get("visibility")
+        
+        # Flag data served from the fallback cache while the API is unreachable
+        stale_marker = " (cached)" if stale else ""
+        
+        # Fill the template directly from the raw fields
+        return _TEMPLATE.format(
+            location=location,
+            stale=stale_marker,
+            temp=_measure(main.get("temp"), temp_unit, as_float=True),
+            feels=_measure(main.get("feels_like"), temp_unit, as_float=True),
+            cond=condition,
+            hum=_measure(main.get("humidity"), "%"),
+            wind=wind_text,
+            p=_measure(main.get("pressure"), " hPa"),
+            vis=_MISSING if visibility is None else f"{visibility / 1000:.1f} km"  # Convert to km
+        )
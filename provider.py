@@ -1,15 +1,79 @@
 """
 Provider for the OpenWeatherMap API.
 """
+import asyncio
+import functools
+import hashlib
+import logging
 import os
+import random
+import statistics
+import time
 import httpx
+import orjson
+from collections import deque
 from typing import Dict, Any, Optional, Union, Tuple
 from dotenv import load_dotenv
+from pydantic import TypeAdapter, ValidationError
 
-from models import CurrentWeatherResponse, WeatherError
+from models import WeatherError
+
+try:
+    import redis.asyncio as aioredis
+    from redis.exceptions import RedisError
+except ImportError:  # Redis is optional; caching is disabled without it
+    aioredis = None
+    RedisError = Exception
+
+logger = logging.getLogger(__name__)
+
+# Validates error bodies straight from raw JSON bytes
+_ERROR_ADAPTER = TypeAdapter(WeatherError)
+
+# Cache TTL (seconds) per API endpoint
+CACHE_POLICIES = {
+    "/weather": 120,
+}
+
+# Redis connect/read timeout (seconds), kept short so an unreachable cache costs little
+REDIS_TIMEOUT = 0.25
+
+# Seconds the cache is bypassed after a Redis error before it is tried again
+REDIS_RETRY_AFTER = 30.0
+
+# TTL (seconds) of the last known good response served when the API is failing
+STALE_CACHE_TTL = 24 * 60 * 60
+
+# Random +/- fraction applied to cache TTLs so entries don't expire together
+CACHE_TTL_JITTER = 0.15
+
+# Extra cache TTL (seconds) per second of average upstream latency, capped at
+# CACHE_MAX_BUFFER_RATIO of the base TTL, so data lives longer when the API is slow
+CACHE_LATENCY_BUFFER_FACTOR = 60
+CACHE_MAX_BUFFER_RATIO = 0.5
+
+# Smoothing factor for the upstream latency moving average
+LATENCY_EWMA_ALPHA = 0.2
+
+# Number of recent upstream response times kept for latency percentiles
+STATS_LATENCY_SAMPLES = 1000
+
+# Statistics reported before any request has been made
+EMPTY_STATS = {
+    "hits": 0,
+    "misses": 0,
+    "errors": 0,
+    "hit_ratio": None,
+    "p50_ms": None,
+    "p99_ms": None
+}
+
+
+@functools.lru_cache(maxsize=1024)
+def _join_city_cc(city: str, country_code: str) -> str:
+    """Build the "city,country" query value, memoized for repeated lookups."""
+    return f"{city},{country_code}"
 
-# Load environment variables
-load_dotenv()
 
 class OpenWeatherMapProvider:
     """Provider for interacting with the OpenWeatherMap API."""
@@ -18,6 +82,10 @@ class OpenWeatherMapProvider:
     
     def __init__(self):
         """Initialize the provider with API key from environment variables."""
+        # Only search for a .env file when the key isn't already in the environment
+        if not os.environ.get("OPENWEATHER_API_KEY"):
+            load_dotenv()
+        
         self.api_key = os.getenv("OPENWEATHER_API_KEY")
         if not self.api_key:
             raise ValueError("OpenWeatherMap API key not found. Please set OPENWEATHER_API_KEY environment variable.")
@@ -26,6 +94,55 @@ class OpenWeatherMapProvider:
             "User-Agent": "OpenWeatherMapMCPServer/1.0",
             "Accept": "application/json"
         }
+        
+        # Shared HTTP/2 client so concurrent calls multiplex over pooled connections;
+        # the API key is sent as a default query parameter on every request
+        self._client = httpx.AsyncClient(
+            base_url=self.BASE_URL,
+            headers=self.headers,
+            timeout=30.0,
+            limits=httpx.Limits(
+                max_connections=100,
+                max_keepalive_connections=10,
+                keepalive_expiry=60.0
+            ),
+            http2=True,
+            params={"appid": self.api_key}
+        )
+        
+        # Moving average of upstream response time (seconds), used to size cache TTLs
+        self._upstream_latency = 0.0
+        
+        # Cache and upstream counters reported by get_stats()
+        self._stats = {
+            "hits": 0,
+            "misses": 0,
+            "errors": 0,
+            "upstream_ns": deque(maxlen=STATS_LATENCY_SAMPLES)
+        }
+        
+        # In-flight requests by cache digest, shared by concurrent identical lookups
+        self._inflight: Dict[str, asyncio.Future] = {}
+        
+        # Optional Redis response cache, enabled with WEATHER_CACHE=1
+        self._redis = None
+        cache_enabled = os.getenv("WEATHER_CACHE", "").lower() in ("1", "true", "yes")
+        if cache_enabled and aioredis is not None:
+            self._redis = aioredis.from_url(
+                os.getenv("REDIS_URL", "redis://localhost:6379"),
+                decode_responses=False,
+                socket_connect_timeout=REDIS_TIMEOUT,
+                socket_timeout=REDIS_TIMEOUT
+            )
+        
+        # Monotonic time until which the cache is skipped after a Redis error
+        self._redis_retry_at = 0.0
+    
+    async def aclose(self) -> None:
+        """Close the underlying HTTP client and cache connections."""
+        await self._client.aclose()
+        if self._redis is not None:
+            await self._redis.aclose()
     
     async def get_current_weather_by_coords(
         self, 
@@ -33,7 +150,7 @@ class OpenWeatherMapProvider:
         lon: float, 
         units: str = "metric",
         lang: str = "en"
-    ) -> Tuple[Union[CurrentWeatherResponse, WeatherError], bool]:
+    ) -> Tuple[Union[Dict[str, Any], WeatherError], bool, bool]:
         """
         Get current weather by geographic coordinates.
         
@@ -44,12 +161,12 @@ class OpenWeatherMapProvider:
             lang: Language for weather descriptions
             
         Returns:
-            Tuple containing the response (either weather data or error) and a boolean indicating success
+            Tuple containing the response (either weather data or error), a boolean indicating success
+            and a boolean indicating the data is stale, served from the fallback cache
         """
         params = {
             "lat": lat,
             "lon": lon,
-            "appid": self.api_key,
             "units": units,
             "lang": lang
         }
@@ -62,7 +179,7 @@ class OpenWeatherMapProvider:
         country_code: Optional[str] = None,
         units: str = "metric",
         lang: str = "en"
-    ) -> Tuple[Union[CurrentWeatherResponse, WeatherError], bool]:
+    ) -> Tuple[Union[Dict[str, Any], WeatherError], bool, bool]:
         """
         Get current weather by city name.
         
@@ -73,15 +190,11 @@ class OpenWeatherMapProvider:
             lang: Language for weather descriptions
             
         Returns:
-            Tuple containing the response (either weather data or error) and a boolean indicating success
+            Tuple containing the response (either weather data or error), a boolean indicating success
+            and a boolean indicating the data is stale, served from the fallback cache
         """
-        location = city
-        if country_code:
-            location = f"{city},{country_code}"
-            
         params = {
-            "q": location,
-            "appid": self.api_key,
+            "q": _join_city_cc(city, country_code) if country_code else city,
             "units": units,
             "lang": lang
         }
@@ -94,7 +207,7 @@ class OpenWeatherMapProvider:
         country_code: str = "us",
         units: str = "metric",
         lang: str = "en"
-    ) -> Tuple[Union[CurrentWeatherResponse, WeatherError], bool]:
+    ) -> Tuple[Union[Dict[str, Any], WeatherError], bool, bool]:
         """
         Get current weather by zip/postal code.
         
@@ -105,11 +218,11 @@ class OpenWeatherMapProvider:
             lang: Language for weather descriptions
             
         Returns:
-            Tuple containing the response (either weather data or error) and a boolean indicating success
+            Tuple containing the response (either weather data or error), a boolean indicating success
+            and a boolean indicating the data is stale, served from the fallback cache
         """
         params = {
             "zip": f"{zip_code},{country_code}",
-            "appid": self.api_key,
             "units": units,
             "lang": lang
         }
@@ -120,7 +233,7 @@ class OpenWeatherMapProvider:
         self, 
         endpoint: str, 
         params: Dict[str, Any]
-    ) -> Tuple[Union[CurrentWeatherResponse, WeatherError], bool]:
+    ) -> Tuple[Union[Dict[str, Any], WeatherError], bool, bool]:
         """
         Make a request to the OpenWeatherMap API.
         
@@ -129,21 +242,287 @@ class OpenWeatherMapProvider:
             params: Query parameters
             
         Returns:
-            Tuple containing the response (either weather data or error) and a boolean indicating success
+            Tuple containing the response (either weather data or error), a boolean indicating success
+            and a boolean indicating the data is stale, served from the fallback cache
+        """
+        digest = self._cache_digest(endpoint, params)
+        
+        # Coalesce concurrent identical lookups into a single upstream request.
+        # The fetch runs as its own task so a cancelled caller does not cancel
+        # it for the others waiting on the same result.
+        inflight = self._inflight.get(digest)
+        if inflight is None:
+            inflight = asyncio.ensure_future(self._fetch(endpoint, params, digest))
+            self._inflight[digest] = inflight
+            inflight.add_done_callback(lambda _: self._inflight.pop(digest, None))
+        
+        return await asyncio.shield(inflight)
+    
+    async def _fetch(
+        self, 
+        endpoint: str, 
+        params: Dict[str, Any],
+        digest: str
+    ) -> Tuple[Union[Dict[str, Any], WeatherError], bool, bool]:
         """
-        url = f"{self.BASE_URL}{endpoint}"
+        Fetch a response from the cache or the OpenWeatherMap API.
+        
+        Args:
+            endpoint: API endpoint
+            params: Query parameters
+            digest: Request digest from _cache_digest
+            
+        Returns:
+            Tuple containing the response (either weather data or error), a boolean indicating success
+            and a boolean indicating the data is stale, served from the fallback cache
+        """
+        # A missing, unreadable or unavailable cache entry falls through to the live API
+        cached = self._decode_json(await self._redis_get(f"owm:{digest}"))
+        if cached is not None:
+            self._stats["hits"] += 1
+            return cached, True, False
+        
+        if self._redis is not None:
+            self._stats["misses"] += 1
         
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.get(url, params=params, headers=self.headers, timeout=30.0)
-                data = response.json()
+            started = time.perf_counter_ns()
+            response = await self._client.get(endpoint, params=params)
+            self._record_latency(time.perf_counter_ns() - started)
+            logger.debug("GET %s returned %s over %s", endpoint, response.status_code, response.http_version)
+            if response.status_code == 200:
+                # Returned as a raw dict shaped like models.CurrentWeatherResponse
+                data = orjson.loads(response.content)
+                await self._cache_set(digest, response.content, self._cache_ttl(endpoint))
+                return data, True, False
+            
+            # Prefer the last known good data over an upstream server error
+            if response.status_code >= 500:
+                self._stats["errors"] += 1
+                stale = await self._cache_get_stale(digest)
+                if stale is not None:
+                    return stale, True, True
+            
+            try:
+                error = _ERROR_ADAPTER.validate_json(response.content)
+            except ValidationError:
+                # Not an OpenWeatherMap error body (e.g. an HTML page from a gateway)
+                error = WeatherError(cod=response.status_code, message=response.reason_phrase)
+            return error, False, False
                 
-                if response.status_code == 200:
-                    return CurrentWeatherResponse(**data), True
-                else:
-                    return WeatherError(**data), False
-                    
         except httpx.RequestError as e:
-            return WeatherError(cod=500, message=f"Request error: {str(e)}"), False
+            self._stats["errors"] += 1
+            stale = await self._cache_get_stale(digest)
+            if stale is not None:
+                return stale, True, True
+            return WeatherError(cod=500, message=f"Request error: {str(e)}"), False, False
         except Exception as e:
-            return WeatherError(cod=500, message=f"Unexpected error: {str(e)}"), False
+            self._stats["errors"] += 1
+            return WeatherError(cod=500, message=f"Unexpected error: {str(e)}"), False, False
+    
+    async def get_cached_text(self, endpoint: str, query: Dict[str, Any]) -> Optional[str]:
+        """
+        Get a cached formatted result for a lookup.
+        
+        Args:
+            endpoint: API endpoint the result was derived from
+            query: Lookup parameters identifying the result
+            
+        Returns:
+            The cached text, or None on a miss or when caching is disabled
+        """
+        cached = await self._redis_get(f"owm:txt:{self._cache_digest(endpoint, query)}")
+        if cached is None:
+            return None
+        
+        try:
+            text = cached.decode()
+        except UnicodeDecodeError:
+            return None
+        
+        self._stats["hits"] += 1
+        return text
+    
+    async def set_cached_text(self, endpoint: str, query: Dict[str, Any], text: str) -> None:
+        """
+        Cache a formatted result for a lookup with the endpoint's TTL, ignoring cache failures.
+        
+        Args:
+            endpoint: API endpoint the result was derived from
+            query: Lookup parameters identifying the result
+            text: Formatted result
+        """
+        ttl = self._cache_ttl(endpoint)
+        if ttl:
+            await self._redis_set(f"owm:txt:{self._cache_digest(endpoint, query)}", text.encode(), ttl)
+    
+    @staticmethod
+    def _cache_digest(endpoint: str, params: Dict[str, Any]) -> str:
+        """
+        Hash a request into the digest used for its cache keys.
+        
+        Args:
+            endpoint: API endpoint
+            params: Query parameters
+            
+        Returns:
+            Hex digest of the endpoint and normalized parameters
+        """
+        return hashlib.blake2b(
+            endpoint.encode() + orjson.dumps(params, option=orjson.OPT_SORT_KEYS),
+            digest_size=16
+        ).hexdigest()
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Get cache and upstream request statistics.
+        
+        Returns:
+            Cache hit/miss counts and ratio (None when caching is disabled), upstream
+            error count, and p50/p99 upstream latency in milliseconds over recent requests
+        """
+        hits = self._stats["hits"]
+        misses = self._stats["misses"]
+        samples = [ns / 1_000_000 for ns in self._stats["upstream_ns"]]
+        
+        p50_ms = p99_ms = None
+        if len(samples) >= 2:
+            percentiles = statistics.quantiles(samples, n=100, method="inclusive")
+            p50_ms, p99_ms = percentiles[49], percentiles[98]
+        elif samples:
+            p50_ms = p99_ms = samples[0]
+        
+        return {
+            "hits": hits,
+            "misses": misses,
+            "errors": self._stats["errors"],
+            "hit_ratio": hits / (hits + misses) if hits + misses else None,
+            "p50_ms": p50_ms,
+            "p99_ms": p99_ms
+        }
+    
+    def _record_latency(self, elapsed_ns: int) -> None:
+        """
+        Record an upstream response time for stats and the TTL moving average.
+        
+        Args:
+            elapsed_ns: Response time in nanoseconds
+        """
+        self._stats["upstream_ns"].append(elapsed_ns)
+        elapsed = elapsed_ns / 1_000_000_000
+        self._upstream_latency += LATENCY_EWMA_ALPHA * (elapsed - self._upstream_latency)
+    
+    def _cache_ttl(self, endpoint: str) -> Optional[int]:
+        """
+        Get the cache TTL for an endpoint, with jitter and a latency-based buffer.
+        
+        Args:
+            endpoint: API endpoint
+            
+        Returns:
+            TTL in seconds, or None if the endpoint is not cached
+        """
+        ttl = CACHE_POLICIES.get(endpoint)
+        if not ttl:
+            return None
+        
+        buffer = min(self._upstream_latency * CACHE_LATENCY_BUFFER_FACTOR, ttl * CACHE_MAX_BUFFER_RATIO)
+        jitter = random.uniform(1 - CACHE_TTL_JITTER, 1 + CACHE_TTL_JITTER)
+        return max(1, int((ttl + buffer) * jitter))
+    
+    async def _cache_set(self, digest: str, content: bytes, ttl: Optional[int]) -> None:
+        """
+        Store a raw response body in the cache, ignoring cache failures.
+        
+        The body is written twice: once with the TTL for normal cache hits and
+        once with STALE_CACHE_TTL as the last known good response, used when the
+        API is unreachable or failing.
+        
+        Args:
+            digest: Request digest from _cache_digest
+            content: Raw response body
+            ttl: Time to live in seconds; nothing is cached when not set
+        """
+        if not ttl:
+            return
+        
+        await self._redis_set(f"owm:{digest}", content, ttl)
+        await self._redis_set(f"owm:last:{digest}", content, STALE_CACHE_TTL)
+    
+    async def _cache_get_stale(self, digest: str) -> Optional[Dict[str, Any]]:
+        """
+        Get the last known good response for a request, regardless of its normal TTL.
+        
+        Args:
+            digest: Request digest from _cache_digest
+            
+        Returns:
+            The last cached weather data, or None if nothing is cached
+        """
+        return self._decode_json(await self._redis_get(f"owm:last:{digest}"))
+    
+    async def _redis_get(self, key: str) -> Optional[bytes]:
+        """
+        Get a value from Redis, treating cache failures as a miss.
+        
+        Args:
+            key: Cache key
+            
+        Returns:
+            The cached value, or None on a miss or when the cache is disabled or unavailable
+        """
+        if self._redis is None or time.monotonic() < self._redis_retry_at:
+            return None
+        
+        try:
+            return await self._redis.get(key)
+        except RedisError as e:
+            self._redis_failed(e)
+            return None
+    
+    async def _redis_set(self, key: str, value: bytes, ttl: Optional[int] = None) -> None:
+        """
+        Store a value in Redis, ignoring cache failures.
+        
+        Args:
+            key: Cache key
+            value: Value to store
+            ttl: Time to live in seconds; the key does not expire when not set
+        """
+        if self._redis is None or time.monotonic() < self._redis_retry_at:
+            return
+        
+        try:
+            await self._redis.set(key, value, ex=ttl)
+        except RedisError as e:
+            self._redis_failed(e)
+    
+    def _redis_failed(self, error: Exception) -> None:
+        """
+        Bypass the cache for REDIS_RETRY_AFTER seconds after a Redis error.
+        
+        Args:
+            error: The Redis error that occurred
+        """
+        logger.warning("Redis cache unavailable, bypassing for %.0fs: %s", REDIS_RETRY_AFTER, error)
+        self._redis_retry_at = time.monotonic() + REDIS_RETRY_AFTER
+    
+    @staticmethod
+    def _decode_json(content: Optional[bytes]) -> Optional[Dict[str, Any]]:
+        """
+        Decode a cached JSON body, treating unreadable entries as a miss.
+        
+        Args:
+            content: Cached body, if any
+            
+        Returns:
+            The decoded object, or None if nothing was cached or it isn't a valid JSON object
+        """
+        if content is None:
+            return None
+        
+        try:
+            data = orjson.loads(content)
+        except orjson.JSONDecodeError:
+            return None
+        return data if isinstance(data, dict) else None
@@ -4,19 +4,38 @@ OpenWeatherMap MCP Server.
 This server provides tools to interact with the OpenWeatherMap API
 following the Model-Controller-Provider (MCP) architecture pattern.
 """
+import functools
+import json
 import os
 import sys
-from typing import Optional, Annotated
+from contextlib import asynccontextmanager
+from types import MappingProxyType
+from typing import List, Optional, Annotated
 from fastmcp import FastMCP, Context
 from pydantic import Field
 
 from controller import WeatherController
 
-# Initialize the FastMCP server
-mcp = FastMCP(name="OpenWeatherMap MCP Server")
+@functools.lru_cache()
+def _get_controller() -> WeatherController:
+    """Get the shared weather controller, created on first use."""
+    return WeatherController()
+
 
-# Initialize the weather controller
-weather_controller = WeatherController()
+@asynccontextmanager
+async def lifespan(server: FastMCP):
+    """Close the controller's pooled HTTP connections on server shutdown."""
+    try:
+        yield
+    finally:
+        await _get_controller().aclose()
+
+
+# Maximum number of cities accepted by get_weather_for_cities in one call
+MAX_BATCH_CITIES = 20
+
+# Initialize the FastMCP server
+mcp = FastMCP(name="OpenWeatherMap MCP Server", lifespan=lifespan)
 
 
 @mcp.tool()
@@ -34,7 +53,7 @@ async def get_weather_by_city(
     optionally filtered by country code. You can specify the units of measurement
     and the language for weather descriptions.
     """
-    return await weather_controller.get_weather_by_city(
+    return await _get_controller().get_weather_by_city(
         city=city,
         country_code=country_code,
         units=units,
@@ -43,6 +62,30 @@ async def get_weather_by_city(
     )
 
 
+@mcp.tool()
+async def get_weather_for_cities(
+    cities: Annotated[List[str], Field(description=f"City names, at most {MAX_BATCH_CITIES} (e.g., ['London', 'Paris'])", max_length=MAX_BATCH_CITIES)],
+    country_code: Annotated[Optional[str], Field(description="Country code applied to every city (e.g., 'uk' for United Kingdom)")] = None,
+    units: Annotated[str, Field(description="Units of measurement: 'metric' (°C), 'imperial' (°F), or 'standard' (K)")] = "metric",
+    lang: Annotated[str, Field(description="Language for weather descriptions (e.g., 'en', 'es', 'fr')")] = "en",
+    ctx: Context = None
+) -> List[str]:
+    """
+    Get current weather information for several cities at once.
+
+    This tool fetches the current weather conditions for each of the specified
+    cities concurrently and returns one result per city, in the same order.
+    A failed lookup for one city is reported in its slot without affecting the others.
+    """
+    return await _get_controller().get_weather_bulk(
+        cities=cities,
+        country_code=country_code,
+        units=units,
+        lang=lang,
+        ctx=ctx
+    )
+
+
 @mcp.tool()
 async def get_weather_by_coordinates(
     latitude: Annotated[float, Field(description="Latitude coordinate", ge=-90, le=90)],
@@ -57,7 +100,7 @@ async def get_weather_by_coordinates(
     This tool fetches the current weather conditions for specified latitude and longitude
     coordinates. You can specify the units of measurement and the language for weather descriptions.
     """
-    return await weather_controller.get_weather_by_coords(
+    return await _get_controller().get_weather_by_coords(
         lat=latitude,
         lon=longitude,
         units=units,
@@ -81,7 +124,7 @@ async def get_weather_by_zip(
     and country code. You can specify the units of measurement and the language for
     weather descriptions.
     """
-    return await weather_controller.get_weather_by_zip(
+    return await _get_controller().get_weather_by_zip(
         zip_code=zip_code,
         country_code=country_code,
         units=units,
@@ -90,21 +133,34 @@ async def get_weather_by_zip(
     )
 
 
+# Static server information, frozen and serialized once at import
+_ABOUT_INFO = MappingProxyType({
+    "name": "OpenWeatherMap MCP Server",
+    "version": "1.0.0",
+    "description": "A server that provides tools to interact with the OpenWeatherMap API.",
+    "capabilities": (
+        "Current weather by city name",
+        "Current weather for multiple cities in one call",
+        "Current weather by geographic coordinates",
+        "Current weather by zip/postal code"
+    )
+})
+_ABOUT_JSON = json.dumps(dict(_ABOUT_INFO))
+
+
 @mcp.resource("weather://about")
-def get_about_info() -> dict:
+def get_about_info() -> str:
     """Provides information about the OpenWeatherMap MCP server."""
-    return {
-        "name": "OpenWeatherMap MCP Server",
-        "version": "1.0.0",
-        "description": "A server that provides tools to interact with the OpenWeatherMap API.",
-        "capabilities": [
-            "Current weather by city name",
-            "Current weather by geographic coordinates",
-            "Current weather by zip/postal code"
-        ]
-    }
+    return _ABOUT_JSON
+
+
+@mcp.resource("weather://stats")
+def get_stats() -> dict:
+    """Provides cache hit/miss counts and upstream latency percentiles."""
+    return _get_controller().get_stats()
 
 
+@functools.lru_cache(maxsize=1)
 def determine_transport():
     """
     Determine which transport to use based on environment or command line arguments.
@@ -124,7 +180,8 @@ def determine_transport():
         elif sys.argv[1].lower() == "http":
             return "streamable-http"
 
-    # Check if running in a container (likely Smithery)
+    # Check if running in a container (likely Smithery); the /.dockerenv
+    # stat is only made when CONTAINER is unset
     if os.environ.get("CONTAINER", "") or os.path.exists("/.dockerenv"):
         return "stdio"
 
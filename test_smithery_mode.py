@@ -1,31 +1,29 @@
 """
 Test script for the OpenWeatherMap MCP server in Smithery mode.
 
-This script runs the server in stdio mode and sends a simple request to test functionality.
+This script runs the server in stdio mode and sends a simple request to test functionality,
+then checks that the server keeps working across sequential in-memory client sessions.
 """
 import asyncio
 import json
 import os
 import sys
-import subprocess
 from fastmcp import Client
+from fastmcp.client.transports import PythonStdioTransport
 
 async def test_server():
     """Test the server by connecting to it and calling a tool."""
     print("Starting OpenWeatherMap MCP server in stdio mode...")
     
-    # Start the server process
-    server_process = subprocess.Popen(
-        [sys.executable, "server.py", "stdio"],
-        stdin=subprocess.PIPE,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        text=False
-    )
-    
     try:
-        # Create a client that connects to the server process
-        client = Client(server_process)
+        # Create a client that starts the server process asynchronously over stdio;
+        # the process is terminated and reaped when the client context exits
+        client = Client(PythonStdioTransport(
+            "server.py",
+            args=["stdio"],
+            env=dict(os.environ),
+            python_cmd=sys.executable
+        ))
         
         print("Connecting to server...")
         async with client:
@@ -50,13 +48,31 @@ async def test_server():
                 
     except Exception as e:
         print(f"Error: {e}")
-    finally:
-        # Terminate the server process
-        server_process.terminate()
-        try:
-            server_process.wait(timeout=5)
-        except subprocess.TimeoutExpired:
-            server_process.kill()
+
+async def test_sequential_sessions():
+    """Test that the server keeps working across sequential client sessions."""
+    print("\nTesting sequential in-memory sessions...")
+    
+    # Imported here so the stdio test doesn't load the server in this process
+    from server import mcp
+    
+    try:
+        # Each session runs the server lifespan, which closes the provider's
+        # HTTP client on exit; the next session must get a working client
+        for session in range(2):
+            async with Client(mcp) as client:
+                result = await client.call_tool(
+                    "get_weather_by_city", 
+                    {"city": "London", "country_code": "uk"}
+                )
+                text = result.content[0].text
+                print(f"Session {session + 1}: {text}")
+                if "client has been closed" in text:
+                    print("\nTest failed: session reused a closed HTTP client.")
+                    return
+        print("\nTest successful!")
+    except Exception as e:
+        print(f"Error: {e}")
 
 if __name__ == "__main__":
     # Check if API key is set
@@ -65,5 +81,6 @@ if __name__ == "__main__":
         print("Please set it before running this test script.")
         sys.exit(1)
     
-    # Run the test
+    # Run the tests
     asyncio.run(test_server())
+    asyncio.run(test_sequential_sessions())